@@ -3,37 +3,32 @@ API endpoints for data refresh operations
 """
 
 from fastapi import APIRouter, HTTPException, BackgroundTasks
+from app.dependencies import get_calculator
 from app.models import DataRefreshRequest, DataRefreshResponse
-from app.services.risk_calculator import RiskCalculator
+from app.services.risk_calculator import RISK_CATEGORIES
 from datetime import datetime
 import logging
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
-calculator = RiskCalculator()
 
 
-def refresh_data_background(data_types: list = None):
-    """Background task to refresh data"""
+async def refresh_data_background(data_types: list = None):
+    """Background task to refresh data, fetching all categories concurrently"""
     try:
         if data_types is None:
-            data_types = ["market", "supply_chain", "regulatory", "hr"]
+            data_types = list(RISK_CATEGORIES)
         
         refreshed = []
         for data_type in data_types:
-            try:
-                if data_type == "market":
-                    calculator.calculate_market_risk()
-                elif data_type == "supply_chain":
-                    calculator.calculate_supply_chain_risk()
-                elif data_type == "regulatory":
-                    calculator.calculate_regulatory_risk()
-                elif data_type == "hr":
-                    calculator.calculate_hr_risk()
+            if data_type in RISK_CATEGORIES:
                 refreshed.append(data_type)
-            except Exception as e:
-                logger.error(f"Error refreshing {data_type}: {e}")
+            else:
+                logger.error(f"Error refreshing {data_type}: unknown risk category")
+        
+        # Recalculated scores are written with a single commit off the event loop
+        await get_calculator().calculate_risks(refreshed, refresh=True)
         
         return refreshed
     except Exception as e:
@@ -51,7 +46,7 @@ async def refresh_data(
     Runs in background to avoid blocking
     """
     try:
-        data_types = request.data_types or ["market", "supply_chain", "regulatory", "hr"]
+        data_types = request.data_types or list(RISK_CATEGORIES)
         
         # Add background task
         background_tasks.add_task(refresh_data_background, data_types)
@@ -68,37 +63,42 @@ async def refresh_data(
 
 
 @router.get("/status")
-async def get_data_status():
+def get_data_status():
     """
     Get status of cached data (freshness, expiry)
     """
     from app.database import RiskDataCache, SessionLocal
     from datetime import datetime
+    from sqlalchemy import case, func
     
     db = SessionLocal()
     try:
-        cache_entries = db.query(RiskDataCache).all()
+        now = datetime.utcnow()
+        # Aggregate in SQL: one row per (data_type, source) instead of every cache entry
+        rows = db.query(
+            RiskDataCache.data_type,
+            RiskDataCache.source,
+            func.count(RiskDataCache.id),
+            func.sum(case((RiskDataCache.expires_at < now, 1), else_=0))
+        ).group_by(
+            RiskDataCache.data_type,
+            RiskDataCache.source
+        ).all()
         
         status = {}
-        for entry in cache_entries:
-            if entry.data_type not in status:
-                status[entry.data_type] = {
-                    "sources": [],
-                    "total_entries": 0,
-                    "expired_entries": 0
-                }
-            
-            status[entry.data_type]["total_entries"] += 1
-            if entry.expires_at < datetime.utcnow():
-                status[entry.data_type]["expired_entries"] += 1
-            
-            if entry.source not in status[entry.data_type]["sources"]:
-                status[entry.data_type]["sources"].append(entry.source)
+        for data_type, source, total, expired in rows:
+            entry = status.setdefault(data_type, {
+                "sources": [],
+                "total_entries": 0,
+                "expired_entries": 0
+            })
+            entry["sources"].append(source)
+            entry["total_entries"] += total
+            entry["expired_entries"] += expired or 0
         
         return {
             "status": status,
-            "checked_at": datetime.utcnow()
+            "checked_at": now
         }
     finally:
         db.close()
-
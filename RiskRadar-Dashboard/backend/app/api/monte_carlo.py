@@ -2,7 +2,8 @@
 API endpoints for Monte Carlo simulations
 """
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends
+from app.dependencies import get_simulator, VALID_CATEGORIES, INVALID_CATEGORY_MESSAGE
 from app.models import MonteCarloRequest, MonteCarloResponse
 from app.services.monte_carlo import MonteCarloSimulator
 import logging
@@ -10,21 +11,19 @@ import logging
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
-simulator = MonteCarloSimulator()
 
 
 @router.post("/simulate", response_model=MonteCarloResponse)
-async def run_monte_carlo(request: MonteCarloRequest):
+def run_monte_carlo(
+    request: MonteCarloRequest,
+    simulator: MonteCarloSimulator = Depends(get_simulator)
+):
     """
     Run Monte Carlo simulation for a risk category
     Uses historical data to estimate future risk distributions
     """
-    valid_categories = ["market", "supply_chain", "regulatory", "hr"]
-    if request.risk_category not in valid_categories:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Invalid category. Must be one of: {', '.join(valid_categories)}"
-        )
+    if request.risk_category not in VALID_CATEGORIES:
+        raise HTTPException(status_code=400, detail=INVALID_CATEGORY_MESSAGE)
     
     try:
         result = simulator.run_simulation(
@@ -39,16 +38,15 @@ async def run_monte_carlo(request: MonteCarloRequest):
 
 
 @router.get("/scenarios/{category}")
-async def get_scenarios(category: str):
+def get_scenarios(
+    category: str,
+    simulator: MonteCarloSimulator = Depends(get_simulator)
+):
     """
     Get multiple scenario simulations (optimistic, baseline, pessimistic)
     """
-    valid_categories = ["market", "supply_chain", "regulatory", "hr"]
-    if category not in valid_categories:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Invalid category. Must be one of: {', '.join(valid_categories)}"
-        )
+    if category not in VALID_CATEGORIES:
+        raise HTTPException(status_code=400, detail=INVALID_CATEGORY_MESSAGE)
     
     try:
         result = simulator.run_multiple_scenarios(category)
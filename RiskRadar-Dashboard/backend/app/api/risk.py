@@ -2,25 +2,27 @@
 API endpoints for risk data
 """
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends
+from sqlalchemy.orm import Session
+from app.database import get_db
 from app.models import RiskRadarResponse, RiskScoreResponse
+from app.dependencies import get_calculator, VALID_CATEGORIES, INVALID_CATEGORY_MESSAGE
 from app.services.risk_calculator import RiskCalculator
 import logging
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
-calculator = RiskCalculator()
 
 
 @router.get("/radar", response_model=RiskRadarResponse)
-async def get_risk_radar():
+async def get_risk_radar(calculator: RiskCalculator = Depends(get_calculator)):
     """
     Get complete risk radar data for all categories
     Returns aggregated risk scores for dashboard visualization
     """
     try:
-        risks = calculator.calculate_all_risks()
+        risks = await calculator.calculate_all_risks()
         return risks
     except Exception as e:
         logger.error(f"Error getting risk radar: {e}")
@@ -28,28 +30,20 @@ async def get_risk_radar():
 
 
 @router.get("/{category}", response_model=RiskScoreResponse)
-async def get_risk_category(category: str):
+async def get_risk_category(
+    category: str,
+    db: Session = Depends(get_db),
+    calculator: RiskCalculator = Depends(get_calculator)
+):
     """
     Get risk score for a specific category
     Categories: market, supply_chain, regulatory, hr
     """
-    valid_categories = ["market", "supply_chain", "regulatory", "hr"]
-    if category not in valid_categories:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Invalid category. Must be one of: {', '.join(valid_categories)}"
-        )
+    if category not in VALID_CATEGORIES:
+        raise HTTPException(status_code=400, detail=INVALID_CATEGORY_MESSAGE)
     
     try:
-        if category == "market":
-            result = calculator.calculate_market_risk()
-        elif category == "supply_chain":
-            result = calculator.calculate_supply_chain_risk()
-        elif category == "regulatory":
-            result = calculator.calculate_regulatory_risk()
-        elif category == "hr":
-            result = calculator.calculate_hr_risk()
-        
+        result = await calculator.calculate_category_risk(category, db=db)
         return result
     except Exception as e:
         logger.error(f"Error calculating {category} risk: {e}")
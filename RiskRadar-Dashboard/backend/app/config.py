@@ -3,20 +3,35 @@ Configuration settings for the application
 """
 
 import os
+import atexit
 import logging
+import logging.handlers
+import queue
 from dotenv import load_dotenv
 
 load_dotenv()
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('app.log')
-    ]
+# Request threads only enqueue records; a background listener thread does
+# the formatting and the console/file I/O
+_log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+_stream_handler = logging.StreamHandler()
+_file_handler = logging.FileHandler('app.log')
+for _handler in (_stream_handler, _file_handler):
+    _handler.setFormatter(_log_formatter)
+
+log_queue = queue.Queue(-1)
+log_listener = logging.handlers.QueueListener(
+    log_queue, _stream_handler, _file_handler, respect_handler_level=True
 )
+log_listener.start()
+atexit.register(log_listener.stop)
+
+# QueueHandler merges the message into the record; leave the layout to the listener's handlers
+_queue_handler = logging.handlers.QueueHandler(log_queue)
+_queue_handler.setFormatter(logging.Formatter('%(message)s'))
+
+logging.basicConfig(level=logging.INFO, handlers=[_queue_handler])
 
 logger = logging.getLogger(__name__)
 
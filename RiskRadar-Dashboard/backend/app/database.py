@@ -3,37 +3,84 @@ Database configuration and initialization
 Uses SQLite for prototyping, easily upgradeable to PostgreSQL
 """
 
-from sqlalchemy import create_engine, Column, Integer, Float, String, DateTime, JSON
+from sqlalchemy import (
+    create_engine, event, inspect, text, Column, Integer, Float, String, DateTime, JSON, UniqueConstraint
+)
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from contextlib import contextmanager
+from typing import Optional
+import orjson
 import os
 from datetime import datetime
 
 # Database URL from environment or default to SQLite
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./risk_data.db")
 
+IN_MEMORY_SQLITE = DATABASE_URL == "sqlite://" or ":memory:" in DATABASE_URL
+
+# SQLite pragmas applied to every new connection:
+# WAL lets readers proceed during writes, NORMAL sync drops the per-commit fsync,
+# and temp tables, mmap and page cache are kept in memory
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-64000",
+)
+
+def _json_serializer(obj) -> str:
+    """Serialize JSON columns with orjson, which also handles NumPy scalars and datetimes"""
+    return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+
+
 # Create engine
 engine = create_engine(
     DATABASE_URL,
-    connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {}
+    json_serializer=_json_serializer,
+    json_deserializer=orjson.loads,
+    connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {},
+    # In-memory SQLite uses a single-connection pool that takes no sizing options
+    **({} if IN_MEMORY_SQLITE else {"pool_size": 10, "max_overflow": 20})
 )
 
+if "sqlite" in DATABASE_URL:
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        """Tune each new SQLite connection for concurrent cache reads/writes"""
+        cursor = dbapi_connection.cursor()
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+        cursor.close()
+
 # Session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 # Base class for models
 Base = declarative_base()
 
+# JSON column type, stored as binary JSONB on PostgreSQL
+JSONType = JSON().with_variant(JSONB(), "postgresql")
+
 
 class RiskDataCache(Base):
     """Cache table for risk data from various APIs"""
     __tablename__ = "risk_data_cache"
+    __table_args__ = (
+        # One live entry per cache key, so writes can be done as an UPSERT;
+        # its index also serves the cache lookup, which matches at most one row
+        UniqueConstraint("data_type", "source", "symbol", name="uq_cache_key"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    data_type = Column(String, index=True)  # e.g., "market", "supply_chain", "regulatory", "hr"
+    data_type = Column(String)  # e.g., "market", "supply_chain", "regulatory", "hr"
     source = Column(String)  # e.g., "alpha_vantage", "fred", "sec"
-    symbol = Column(String, index=True)  # e.g., stock ticker, indicator code
-    data = Column(JSON)  # Cached API response
+    symbol = Column(String)  # e.g., stock ticker, indicator code
+    data = Column(JSONType)  # Cached API response
+    etag = Column(String, nullable=True)  # Upstream ETag, for If-None-Match revalidation
+    last_modified = Column(String, nullable=True)  # Upstream Last-Modified, for If-Modified-Since
     created_at = Column(DateTime, default=datetime.utcnow)
     expires_at = Column(DateTime, index=True)
 
@@ -45,7 +92,7 @@ class RiskScore(Base):
     id = Column(Integer, primary_key=True, index=True)
     risk_category = Column(String, index=True)  # market, supply_chain, regulatory, hr
     score = Column(Float)  # Normalized score 0-100
-    raw_data = Column(JSON)  # Source data used for calculation
+    raw_data = Column(JSONType)  # Source data used for calculation
     calculated_at = Column(DateTime, default=datetime.utcnow, index=True)
 
 
@@ -57,14 +104,61 @@ class MonteCarloResult(Base):
     risk_category = Column(String, index=True)
     mean = Column(Float)
     std = Column(Float)
-    percentiles = Column(JSON)  # {5: value, 50: value, 95: value}
+    percentiles = Column(JSONType)  # {5: value, 50: value, 95: value}
     iterations = Column(Integer)
+    raw_hash = Column(String, index=True)  # Hash of the historical scores the run was based on
     calculated_at = Column(DateTime, default=datetime.utcnow, index=True)
 
 
 def init_db():
-    """Initialize database tables"""
+    """Initialize database tables, upgrading ones created by older versions"""
     Base.metadata.create_all(bind=engine)
+    _upgrade_schema()
+
+
+# Indexes created by older versions that the models no longer define
+OBSOLETE_INDEXES = {
+    "risk_data_cache": ("ix_risk_data_cache_data_type", "ix_risk_data_cache_symbol", "ix_cache_lookup"),
+}
+
+
+def _upgrade_schema():
+    """
+    Add columns, indexes and the cache key constraint missing from existing
+    tables, and drop indexes the models no longer define
+    create_all only creates absent tables, so databases created before these
+    were introduced would otherwise fail every query touching them
+    """
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        for table in Base.metadata.sorted_tables:
+            existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing_columns:
+                    column_type = column.type.compile(dialect=conn.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+            
+            existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(conn)
+            for name in OBSOLETE_INDEXES.get(table.name, ()):
+                if name in existing_indexes:
+                    conn.execute(text(f"DROP INDEX {name}"))
+        
+        # SQLite cannot add a constraint to an existing table, but ON CONFLICT
+        # works equally with a unique index; older tables may hold duplicate
+        # keys, so keep only the newest entry of each first
+        cache_keys = {constraint["name"] for constraint in inspector.get_unique_constraints("risk_data_cache")}
+        cache_keys |= {index["name"] for index in inspector.get_indexes("risk_data_cache") if index["unique"]}
+        if "uq_cache_key" not in cache_keys:
+            conn.execute(text(
+                "DELETE FROM risk_data_cache WHERE id NOT IN ("
+                "SELECT MAX(id) FROM risk_data_cache GROUP BY data_type, source, symbol)"
+            ))
+            conn.execute(text(
+                "CREATE UNIQUE INDEX uq_cache_key ON risk_data_cache (data_type, source, symbol)"
+            ))
 
 
 def get_db():
@@ -75,3 +169,17 @@ def get_db():
     finally:
         db.close()
 
+
+
+@contextmanager
+def session_scope(db: Optional[Session] = None):
+    """Reuse the caller's session if given, otherwise open one closed on exit"""
+    if db is not None:
+        yield db
+        return
+    
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
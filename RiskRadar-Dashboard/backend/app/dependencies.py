@@ -0,0 +1,45 @@
+"""
+Shared FastAPI dependencies
+Provides process-wide service instances and category validation
+"""
+
+import threading
+from functools import lru_cache
+from typing import Optional
+from app.services.risk_calculator import RiskCalculator, RISK_CATEGORIES
+from app.services.monte_carlo import MonteCarloSimulator
+
+# Category names accepted by the API, with the error message built once
+VALID_CATEGORIES = frozenset(RISK_CATEGORIES)
+INVALID_CATEGORY_MESSAGE = f"Invalid category. Must be one of: {', '.join(RISK_CATEGORIES)}"
+
+
+# The calculator owns the HTTP client and per-provider rate-limit semaphores,
+# so exactly one may exist; sync dependencies run in the threadpool, hence the lock
+_calculator: Optional[RiskCalculator] = None
+_calculator_lock = threading.Lock()
+
+
+def get_calculator() -> RiskCalculator:
+    """Dependency returning the calculator shared by all routers"""
+    global _calculator
+    if _calculator is None:
+        with _calculator_lock:
+            if _calculator is None:
+                _calculator = RiskCalculator()
+    return _calculator
+
+
+async def close_calculator():
+    """Close the shared calculator's HTTP connections if it was created"""
+    global _calculator
+    with _calculator_lock:
+        calculator, _calculator = _calculator, None
+    if calculator is not None:
+        await calculator.aclose()
+
+
+@lru_cache(maxsize=1)
+def get_simulator() -> MonteCarloSimulator:
+    """Dependency returning the Monte Carlo simulator shared by all routers"""
+    return MonteCarloSimulator()
@@ -6,11 +6,14 @@ Main application entry point with API routes and CORS configuration.
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
+import asyncio
 import os
 from dotenv import load_dotenv
 
+from app import config  # noqa: F401  (configures logging)
 from app.api import risk, monte_carlo, data_refresh
 from app.database import init_db
+from app.dependencies import close_calculator
 
 # Load environment variables
 load_dotenv()
@@ -41,7 +44,13 @@ app.include_router(data_refresh.router, prefix="/api/data", tags=["Data"])
 @app.on_event("startup")
 async def startup_event():
     """Initialize database on startup"""
-    init_db()
+    await asyncio.to_thread(init_db)
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Close the calculator's HTTP connections if it was created"""
+    await close_calculator()
 
 
 @app.get("/")
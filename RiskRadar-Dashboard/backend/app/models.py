@@ -13,6 +13,7 @@ class RiskScoreResponse(BaseModel):
     score: float = Field(..., ge=0, le=100, description="Risk score from 0-100")
     raw_data: Optional[Dict] = None
     calculated_at: datetime
+    stale: bool = Field(False, description="True when a fallback is served because calculation failed")
 
 
 class RiskRadarResponse(BaseModel):
@@ -22,6 +23,8 @@ class RiskRadarResponse(BaseModel):
     regulatory_risk: RiskScoreResponse
     hr_risk: RiskScoreResponse
     overall_risk: float = Field(..., ge=0, le=100)
+    risk_variance: float = Field(..., ge=0, description="Weighted variance of category scores")
+    risk_concentration: float = Field(..., ge=0, le=1, description="Herfindahl index of category shares")
     last_updated: datetime
 
 
@@ -0,0 +1,52 @@
+"""
+Numba-compiled Monte Carlo kernel
+Fuses sampling, truncation and the mean/std accumulation into one pass
+"""
+
+import threading
+import numpy as np
+
+# Serializes kernel calls: the endpoints run in a threadpool, and Numba's
+# workqueue threading layer (used when neither OpenMP nor TBB is available,
+# e.g. pip installs on macOS) aborts the process on concurrent parallel calls.
+# Each call already spreads across all cores, so little throughput is lost.
+KERNEL_LOCK = threading.Lock()
+
+try:
+    from numba import config, njit, prange
+    # TBB's pool can hang interpreter shutdown once the kernel has run off the
+    # main thread (as it does under uvicorn), so prefer OpenMP when present
+    config.THREADING_LAYER_PRIORITY = ["omp", "tbb", "workqueue"]
+    NUMBA_AVAILABLE = True
+except ImportError:  # NumPy path in MonteCarloSimulator is used instead
+    NUMBA_AVAILABLE = False
+
+
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def simulate_truncated_normal(mean, std, low, high, n, seed):
+        """
+        Draw n samples from N(mean, std) truncated to [low, high]
+        
+        Out-of-range draws are rejected and redrawn, so callers should only
+        use this kernel when most of the distribution's mass is in range.
+        Each worker thread keeps its own Numba random state, so results are
+        not bit-for-bit reproducible from the seed across thread counts.
+        
+        Samples are stored as float32 while the sums accumulate in float64.
+        
+        Returns:
+            Tuple of (samples, sum of samples, sum of squared samples)
+        """
+        np.random.seed(seed)
+        samples = np.empty(n, dtype=np.float32)
+        total = 0.0
+        total_sq = 0.0
+        for i in prange(n):
+            x = np.random.normal(mean, std)
+            while x < low or x > high:
+                x = np.random.normal(mean, std)
+            samples[i] = x
+            total += x
+            total_sq += x * x
+        return samples, total, total_sq
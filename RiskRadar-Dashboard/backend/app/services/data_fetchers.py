@@ -3,13 +3,17 @@ Data fetching services for various free APIs
 Implements caching and rate limit handling
 """
 
-import requests
+import asyncio
+import httpx
+import orjson
 import os
 from datetime import datetime, timedelta
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Sequence
 import time
+from cachetools import TTLCache
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Session
-from app.database import RiskDataCache, SessionLocal
+from app.database import RiskDataCache, session_scope
 import logging
 
 logger = logging.getLogger(__name__)
@@ -17,19 +21,114 @@ logger = logging.getLogger(__name__)
 # Cache expiry in hours
 CACHE_EXPIRY_HOURS = int(os.getenv("CACHE_EXPIRY_HOURS", "24"))
 
+# Dialect-specific INSERT constructs supporting ON CONFLICT DO UPDATE
+_UPSERT_INSERTS = {
+    "sqlite": sqlite.insert,
+    "postgresql": postgresql.insert
+}
+
+
+# Connection attempts retried by the transport on connect errors
+HTTP_CONNECT_RETRIES = 3
+
+# Attempts per request on timeouts, 429 and 5xx responses, with exponential
+# backoff starting at HTTP_RETRY_BACKOFF_SECONDS between them
+HTTP_RETRY_ATTEMPTS = 3
+HTTP_RETRY_BACKOFF_SECONDS = 0.5
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """
+    Create the async HTTP client shared by all fetchers
+    Keeps connections alive over HTTP/2 (multiplexing concurrent fetches to
+    the same host), retries failed connects and asks for compressed bodies
+    """
+    # Pool and protocol options live on the transport when one is passed in
+    transport = httpx.AsyncHTTPTransport(
+        http2=True,
+        retries=HTTP_CONNECT_RETRIES,
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=10)
+    )
+    return httpx.AsyncClient(
+        timeout=10,
+        transport=transport,
+        headers={
+            "User-Agent": "Enterprise-Risk-Dashboard/1.0",
+            "Accept-Encoding": "gzip, deflate"
+        }
+    )
+
 
 class DataFetcher:
     """Base class for data fetchers with caching"""
     
-    def __init__(self, api_key: Optional[str] = None):
+    # Requests allowed in flight to this provider at once, to respect its rate limits
+    MAX_CONCURRENT_REQUESTS = 4
+    
+    def __init__(self, api_key: Optional[str] = None, client: Optional[httpx.AsyncClient] = None):
         self.api_key = api_key
-        self.session = requests.Session()
-        self.session.headers.update({"User-Agent": "Enterprise-Risk-Dashboard/1.0"})
+        self.client = client or create_http_client()
+        # Created on first request: fetchers may be constructed in a threadpool
+        # worker, where Python 3.9's Semaphore() finds no event loop
+        self._semaphore: Optional[asyncio.Semaphore] = None
     
-    def _get_cached_data(self, data_type: str, source: str, symbol: str) -> Optional[Dict]:
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """
+        Send a request to the provider, waiting for a free concurrency slot
+        Timeouts and rate-limit/server-error responses are retried with
+        exponential backoff; the last response or error is returned/raised
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.MAX_CONCURRENT_REQUESTS)
+        
+        for attempt in range(HTTP_RETRY_ATTEMPTS):
+            last_attempt = attempt == HTTP_RETRY_ATTEMPTS - 1
+            try:
+                async with self._semaphore:
+                    response = await self.client.request(method, url, **kwargs)
+            except httpx.TimeoutException:
+                if last_attempt:
+                    raise
+            else:
+                if response.status_code not in RETRYABLE_STATUS_CODES or last_attempt:
+                    return response
+            
+            # Back off outside the semaphore so other requests can proceed
+            delay = HTTP_RETRY_BACKOFF_SECONDS * 2 ** attempt
+            logger.warning(f"Retrying {method} {url} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+    
+    async def _get_cached_data(
+        self, data_type: str, source: str, symbol: str, db: Optional[Session] = None
+    ) -> Optional[Dict]:
+        """Get cached data if not expired, without blocking the event loop"""
+        return await asyncio.to_thread(self._get_cached_data_sync, data_type, source, symbol, db)
+    
+    async def _cache_data(
+        self, data_type: str, source: str, symbol: str, data: Dict,
+        db: Optional[Session] = None, response: Optional[httpx.Response] = None
+    ):
+        """Cache API response, without blocking the event loop"""
+        await asyncio.to_thread(self._cache_data_sync, data_type, source, symbol, data, db, response)
+    
+    async def _revalidation_headers(
+        self, data_type: str, source: str, symbol: str, db: Optional[Session] = None
+    ) -> Dict[str, str]:
+        """Conditional request headers from the validators of an expired cache entry"""
+        return await asyncio.to_thread(self._revalidation_headers_sync, data_type, source, symbol, db)
+    
+    async def _renew_cached_data(
+        self, data_type: str, source: str, symbol: str, db: Optional[Session] = None
+    ) -> Optional[Dict]:
+        """Extend an expired entry the upstream reported unchanged (HTTP 304) and return its data"""
+        return await asyncio.to_thread(self._renew_cached_data_sync, data_type, source, symbol, db)
+    
+    def _get_cached_data_sync(
+        self, data_type: str, source: str, symbol: str, db: Optional[Session] = None
+    ) -> Optional[Dict]:
         """Get cached data if not expired"""
-        db = SessionLocal()
-        try:
+        with session_scope(db) as db:
             cache_entry = db.query(RiskDataCache).filter(
                 RiskDataCache.data_type == data_type,
                 RiskDataCache.source == source,
@@ -40,46 +139,105 @@ class DataFetcher:
             if cache_entry:
                 return cache_entry.data
             return None
-        finally:
-            db.close()
     
-    def _cache_data(self, data_type: str, source: str, symbol: str, data: Dict):
-        """Cache API response"""
-        db = SessionLocal()
-        try:
-            # Delete old cache entries
-            db.query(RiskDataCache).filter(
+    def _revalidation_headers_sync(
+        self, data_type: str, source: str, symbol: str, db: Optional[Session] = None
+    ) -> Dict[str, str]:
+        """Conditional request headers from the validators of an expired cache entry"""
+        with session_scope(db) as db:
+            validators = db.query(RiskDataCache.etag, RiskDataCache.last_modified).filter(
                 RiskDataCache.data_type == data_type,
                 RiskDataCache.source == source,
                 RiskDataCache.symbol == symbol
-            ).delete()
-            
-            # Create new cache entry
-            cache_entry = RiskDataCache(
-                data_type=data_type,
-                source=source,
-                symbol=symbol,
-                data=data,
-                expires_at=datetime.utcnow() + timedelta(hours=CACHE_EXPIRY_HOURS)
-            )
-            db.add(cache_entry)
-            db.commit()
-        except Exception as e:
-            logger.error(f"Error caching data: {e}")
-            db.rollback()
-        finally:
-            db.close()
+            ).first()
+            
+            headers = {}
+            if validators and validators.etag:
+                headers["If-None-Match"] = validators.etag
+            if validators and validators.last_modified:
+                headers["If-Modified-Since"] = validators.last_modified
+            return headers
+    
+    def _renew_cached_data_sync(
+        self, data_type: str, source: str, symbol: str, db: Optional[Session] = None
+    ) -> Optional[Dict]:
+        """Extend an expired entry the upstream reported unchanged (HTTP 304) and return its data"""
+        with session_scope(db) as db:
+            try:
+                cache_entry = db.query(RiskDataCache).filter(
+                    RiskDataCache.data_type == data_type,
+                    RiskDataCache.source == source,
+                    RiskDataCache.symbol == symbol
+                ).first()
+                if cache_entry is None:
+                    return None
+                
+                cache_entry.expires_at = datetime.utcnow() + timedelta(hours=CACHE_EXPIRY_HOURS)
+                data = cache_entry.data
+                db.commit()
+                return data
+            except Exception as e:
+                logger.error(f"Error renewing cached data: {e}")
+                db.rollback()
+                return None
+    
+    def _cache_data_sync(
+        self, data_type: str, source: str, symbol: str, data: Dict,
+        db: Optional[Session] = None, response: Optional[httpx.Response] = None
+    ):
+        """Cache API response, replacing any previous entry for the same key in one UPSERT"""
+        with session_scope(db) as db:
+            try:
+                now = datetime.utcnow()
+                values = {
+                    "data_type": data_type,
+                    "source": source,
+                    "symbol": symbol,
+                    "data": data,
+                    "etag": response.headers.get("ETag") if response is not None else None,
+                    "last_modified": response.headers.get("Last-Modified") if response is not None else None,
+                    "created_at": now,
+                    "expires_at": now + timedelta(hours=CACHE_EXPIRY_HOURS)
+                }
+                
+                insert = _UPSERT_INSERTS.get(db.get_bind().dialect.name)
+                if insert is not None:
+                    stmt = insert(RiskDataCache).values(**values)
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=["data_type", "source", "symbol"],
+                        set_={
+                            "data": stmt.excluded.data,
+                            "etag": stmt.excluded.etag,
+                            "last_modified": stmt.excluded.last_modified,
+                            "created_at": stmt.excluded.created_at,
+                            "expires_at": stmt.excluded.expires_at
+                        }
+                    )
+                    db.execute(stmt)
+                else:
+                    # Dialects without ON CONFLICT support fall back to delete + insert
+                    db.query(RiskDataCache).filter(
+                        RiskDataCache.data_type == data_type,
+                        RiskDataCache.source == source,
+                        RiskDataCache.symbol == symbol
+                    ).delete()
+                    db.add(RiskDataCache(**values))
+                db.commit()
+            except Exception as e:
+                logger.error(f"Error caching data: {e}")
+                db.rollback()
 
 
 class AlphaVantageFetcher(DataFetcher):
     """Fetcher for Alpha Vantage stock data (25 calls/day free tier)"""
     
     BASE_URL = "https://www.alphavantage.co/query"
+    MAX_CONCURRENT_REQUESTS = 1
     
-    def get_stock_quote(self, symbol: str) -> Optional[Dict]:
+    async def get_stock_quote(self, symbol: str, db: Optional[Session] = None) -> Optional[Dict]:
         """Get stock quote with caching"""
         # Check cache first
-        cached = self._get_cached_data("market", "alpha_vantage", symbol)
+        cached = await self._get_cached_data("market", "alpha_vantage", symbol, db=db)
         if cached:
             return cached
         
@@ -94,9 +252,12 @@ class AlphaVantageFetcher(DataFetcher):
                 "apikey": self.api_key
             }
             
-            response = self.session.get(self.BASE_URL, params=params, timeout=10)
+            headers = await self._revalidation_headers("market", "alpha_vantage", symbol, db=db)
+            response = await self._request("GET", self.BASE_URL, params=params, headers=headers)
+            if response.status_code == 304:
+                return await self._renew_cached_data("market", "alpha_vantage", symbol, db=db)
             response.raise_for_status()
-            data = response.json()
+            data = orjson.loads(response.content)
             
             # Handle API errors
             if "Error Message" in data or "Note" in data:
@@ -105,13 +266,29 @@ class AlphaVantageFetcher(DataFetcher):
             
             # Cache successful response
             if "Global Quote" in data:
-                self._cache_data("market", "alpha_vantage", symbol, data)
+                await self._cache_data("market", "alpha_vantage", symbol, data, db=db, response=response)
                 return data
             
             return None
         except Exception as e:
             logger.error(f"Error fetching Alpha Vantage data: {e}")
             return None
+    
+    async def get_batch_quotes(self, symbols: Sequence[str]) -> Dict[str, Dict]:
+        """
+        Get quotes for several symbols, keyed by symbol
+        Alpha Vantage has retired its BATCH_STOCK_QUOTES function, so each
+        symbol is served from its own cache entry and only the missing ones
+        are fetched with GLOBAL_QUOTE, concurrently within the provider's
+        request limit. Symbols without data are left out.
+        """
+        # Each lookup opens its own session since they run concurrently
+        responses = await asyncio.gather(*(self.get_stock_quote(symbol) for symbol in symbols))
+        return {
+            symbol: data["Global Quote"]
+            for symbol, data in zip(symbols, responses)
+            if data and "Global Quote" in data
+        }
 
 
 class FREDFetcher(DataFetcher):
@@ -119,9 +296,32 @@ class FREDFetcher(DataFetcher):
     
     BASE_URL = "https://api.stlouisfed.org/fred/series/observations"
     
-    def get_economic_indicator(self, series_id: str, limit: int = 100) -> Optional[Dict]:
-        """Get economic indicator data"""
-        cached = self._get_cached_data("market", "fred", series_id)
+    # Seconds a series is served from memory; the indicators used (GDPC1,
+    # UNRATE) are published quarterly/monthly, so hours of staleness are safe
+    SERIES_MEMO_SECONDS = 6 * 3600
+    
+    def __init__(self, api_key: Optional[str] = None, client: Optional[httpx.AsyncClient] = None):
+        super().__init__(api_key, client)
+        # Series data by (series_id, limit), skipping even the database cache lookup
+        self._series_memo = TTLCache(maxsize=64, ttl=self.SERIES_MEMO_SECONDS)
+    
+    async def get_economic_indicator(
+        self, series_id: str, limit: int = 100, db: Optional[Session] = None
+    ) -> Optional[Dict]:
+        """Get economic indicator data, memoized in memory for SERIES_MEMO_SECONDS"""
+        key = (series_id, limit)
+        data = self._series_memo.get(key)
+        if data is None:
+            data = await self._fetch_economic_indicator(series_id, limit, db=db)
+            if data is not None:
+                self._series_memo[key] = data
+        return data
+    
+    async def _fetch_economic_indicator(
+        self, series_id: str, limit: int, db: Optional[Session] = None
+    ) -> Optional[Dict]:
+        """Get economic indicator data from the database cache or the FRED API"""
+        cached = await self._get_cached_data("market", "fred", series_id, db=db)
         if cached:
             return cached
         
@@ -138,12 +338,15 @@ class FREDFetcher(DataFetcher):
                 "sort_order": "desc"
             }
             
-            response = self.session.get(self.BASE_URL, params=params, timeout=10)
+            headers = await self._revalidation_headers("market", "fred", series_id, db=db)
+            response = await self._request("GET", self.BASE_URL, params=params, headers=headers)
+            if response.status_code == 304:
+                return await self._renew_cached_data("market", "fred", series_id, db=db)
             response.raise_for_status()
-            data = response.json()
+            data = orjson.loads(response.content)
             
             if "observations" in data:
-                self._cache_data("market", "fred", series_id, data)
+                await self._cache_data("market", "fred", series_id, data, db=db, response=response)
                 return data
             
             return None
@@ -157,9 +360,12 @@ class SECFetcher(DataFetcher):
     
     BASE_URL = "https://data.sec.gov/api/xbrl/companyconcept/CIK"
     
-    def get_company_filings(self, cik: str, taxonomy: str = "us-gaap", concept: str = "Revenues") -> Optional[Dict]:
+    async def get_company_filings(
+        self, cik: str, taxonomy: str = "us-gaap", concept: str = "Revenues",
+        db: Optional[Session] = None
+    ) -> Optional[Dict]:
         """Get SEC filings data (no API key required)"""
-        cached = self._get_cached_data("regulatory", "sec", f"{cik}_{concept}")
+        cached = await self._get_cached_data("regulatory", "sec", f"{cik}_{concept}", db=db)
         if cached:
             return cached
         
@@ -167,15 +373,18 @@ class SECFetcher(DataFetcher):
             # SEC requires User-Agent header
             headers = {
                 "User-Agent": "Enterprise Risk Dashboard contact@example.com",
-                "Accept": "application/json"
+                "Accept": "application/json",
+                **await self._revalidation_headers("regulatory", "sec", f"{cik}_{concept}", db=db)
             }
             
             url = f"{self.BASE_URL}/{cik.zfill(10)}/{taxonomy}/{concept}.json"
-            response = self.session.get(url, headers=headers, timeout=10)
+            response = await self._request("GET", url, headers=headers)
+            if response.status_code == 304:
+                return await self._renew_cached_data("regulatory", "sec", f"{cik}_{concept}", db=db)
             response.raise_for_status()
-            data = response.json()
+            data = orjson.loads(response.content)
             
-            self._cache_data("regulatory", "sec", f"{cik}_{concept}", data)
+            await self._cache_data("regulatory", "sec", f"{cik}_{concept}", data, db=db, response=response)
             return data
         except Exception as e:
             logger.error(f"Error fetching SEC data: {e}")
@@ -186,10 +395,13 @@ class NewsAPIFetcher(DataFetcher):
     """Fetcher for NewsAPI (100 requests/day, 24-hour delay on free tier)"""
     
     BASE_URL = "https://newsapi.org/v2/everything"
+    MAX_CONCURRENT_REQUESTS = 2
     
-    def get_risk_news(self, query: str, page_size: int = 10) -> Optional[Dict]:
+    async def get_risk_news(
+        self, query: str, page_size: int = 10, db: Optional[Session] = None
+    ) -> Optional[Dict]:
         """Get news articles related to risk (cached to respect rate limits)"""
-        cached = self._get_cached_data("supply_chain", "newsapi", query)
+        cached = await self._get_cached_data("supply_chain", "newsapi", query, db=db)
         if cached:
             return cached
         
@@ -206,12 +418,15 @@ class NewsAPIFetcher(DataFetcher):
                 "language": "en"
             }
             
-            response = self.session.get(self.BASE_URL, params=params, timeout=10)
+            headers = await self._revalidation_headers("supply_chain", "newsapi", query, db=db)
+            response = await self._request("GET", self.BASE_URL, params=params, headers=headers)
+            if response.status_code == 304:
+                return await self._renew_cached_data("supply_chain", "newsapi", query, db=db)
             response.raise_for_status()
-            data = response.json()
+            data = orjson.loads(response.content)
             
             if data.get("status") == "ok":
-                self._cache_data("supply_chain", "newsapi", query, data)
+                await self._cache_data("supply_chain", "newsapi", query, data, db=db, response=response)
                 return data
             
             return None
@@ -224,10 +439,11 @@ class BLSFetcher(DataFetcher):
     """Fetcher for Bureau of Labor Statistics (500 calls/day free)"""
     
     BASE_URL = "https://api.bls.gov/publicAPI/v2/timeseries/data"
+    MAX_CONCURRENT_REQUESTS = 2
     
-    def get_employment_data(self, series_id: str) -> Optional[Dict]:
+    async def get_employment_data(self, series_id: str, db: Optional[Session] = None) -> Optional[Dict]:
         """Get BLS employment data"""
-        cached = self._get_cached_data("hr", "bls", series_id)
+        cached = await self._get_cached_data("hr", "bls", series_id, db=db)
         if cached:
             return cached
         
@@ -239,12 +455,17 @@ class BLSFetcher(DataFetcher):
                 "endyear": "2024"
             }
             
-            response = self.session.post(self.BASE_URL, json=payload, timeout=10)
+            # Encoded with orjson like the responses, instead of httpx's stdlib json
+            response = await self._request(
+                "POST", self.BASE_URL,
+                content=orjson.dumps(payload),
+                headers={"Content-Type": "application/json"}
+            )
             response.raise_for_status()
-            data = response.json()
+            data = orjson.loads(response.content)
             
             if data.get("status") == "REQUEST_SUCCEEDED":
-                self._cache_data("hr", "bls", series_id, data)
+                await self._cache_data("hr", "bls", series_id, data, db=db)
                 return data
             
             return None
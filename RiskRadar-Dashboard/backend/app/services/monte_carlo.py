@@ -3,19 +3,154 @@ Monte Carlo simulation engine for risk analysis
 Uses NumPy for efficient simulations with cached historical data
 """
 
+import hashlib
+from functools import lru_cache
 import numpy as np
-from typing import Dict, Optional
-from datetime import datetime
+from scipy.special import ndtr, ndtri
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
-from app.database import MonteCarloResult, RiskScore, SessionLocal
+from app.database import MonteCarloResult, SessionLocal
+from app.services._mc_kernel import KERNEL_LOCK, NUMBA_AVAILABLE
+from app.services.score_history import get_recent_scores
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Percentiles reported for every simulation
+PERCENTILES = (5, 50, 95)
+
+# Valid range of a risk score
+SCORE_MIN = 0.0
+SCORE_MAX = 100.0
+
+# Minutes a stored result is reused for identical inputs
+RESULT_REUSE_MINUTES = 5
+
+# Minimum share of the untruncated distribution inside [SCORE_MIN, SCORE_MAX]
+# for the rejection-sampling Numba kernel to be used
+KERNEL_MIN_ACCEPTANCE = 0.5
+
+if NUMBA_AVAILABLE:
+    from app.services._mc_kernel import simulate_truncated_normal
+
+
+@lru_cache(maxsize=32)
+def _percentile_positions(n: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Order-statistic indices for PERCENTILES of n samples
+    Returns lower/upper neighbour indices, the interpolation weights between
+    them (matching np.quantile's linear method) and the partition kth array
+    """
+    positions = (n - 1) * np.array(PERCENTILES, dtype=np.float64) / 100
+    lower = np.floor(positions).astype(np.intp)
+    upper = np.minimum(lower + 1, n - 1)
+    weights = positions - lower
+    return lower, upper, weights, np.unique(np.concatenate([lower, upper]))
+
+
+def _summarize_columns(
+    simulations: np.ndarray,
+    sums: Optional[np.ndarray] = None,
+    sums_sq: Optional[np.ndarray] = None
+) -> List[Dict]:
+    """
+    Calculate mean, std and percentiles for each column of an
+    (iterations, streams) simulation matrix
+    Uses one fused sum/sum-of-squares pass and a single partition
+    instead of separate mean/std/percentile passes over the samples.
+    Column sums already accumulated while sampling can be passed in to
+    skip the reduction entirely. The array is partitioned in place.
+    """
+    n = simulations.shape[0]
+    if sums is None or sums_sq is None:
+        # Samples are float32; accumulate in float64 so E[x^2] - E[x]^2 stays accurate
+        sums = simulations.sum(axis=0, dtype=np.float64)
+        # einsum squares and sums each column in one pass without a temporary array
+        sums_sq = np.einsum("ij,ij->j", simulations, simulations, dtype=np.float64)
+    means = np.asarray(sums, dtype=np.float64) / n
+    variances = np.asarray(sums_sq, dtype=np.float64) / n - means * means
+    stds = np.sqrt(np.maximum(variances, 0.0))
+    
+    # One in-place partition around the few order statistics needed for the
+    # fixed percentile set, instead of a general quantile call
+    lower, upper, weights, kth = _percentile_positions(n)
+    simulations.partition(kth, axis=0)
+    low_values = simulations[lower].astype(np.float64)
+    quantiles = low_values + (simulations[upper] - low_values) * weights[:, np.newaxis]
+    
+    return [
+        {
+            "mean": float(means[j]),
+            "std": float(stds[j]),
+            "percentiles": {str(p): float(q) for p, q in zip(PERCENTILES, quantiles[:, j])}
+        }
+        for j in range(simulations.shape[1])
+    ]
+
+
+def _summarize(
+    simulations: np.ndarray,
+    total: Optional[float] = None,
+    total_sq: Optional[float] = None
+) -> Dict:
+    """Calculate mean, std and percentiles of a 1-D simulation array"""
+    if total is None or total_sq is None:
+        return _summarize_columns(simulations[:, np.newaxis])[0]
+    return _summarize_columns(simulations[:, np.newaxis], [total], [total_sq])[0]
+
 
 class MonteCarloSimulator:
     """Monte Carlo simulation for risk forecasting"""
     
+    def __init__(self, seed: Optional[int] = None):
+        # PCG64 Generator reused across requests instead of the legacy global RandomState
+        self.rng = np.random.default_rng(seed)
+    
+    def _sample_truncated_normal(self, means, stds, size) -> np.ndarray:
+        """
+        Sample normal distributions truncated to [SCORE_MIN, SCORE_MAX]
+        Uses inverse-CDF sampling on uniforms so every draw is in range,
+        instead of clipping a plain normal and piling tail mass on the bounds.
+        Samples are float32 to halve memory traffic in the stats passes.
+        
+        Args:
+            means: Scalar or per-column array of distribution means
+            stds: Scalar or per-column array of standard deviations
+            size: Output shape, e.g. iterations or (iterations, streams)
+        """
+        means = np.asarray(means, dtype=np.float64)
+        stds = np.asarray(stds, dtype=np.float64)
+        cdf_low = ndtr((SCORE_MIN - means) / stds)
+        cdf_high = ndtr((SCORE_MAX - means) / stds)
+        
+        samples = self.rng.random(size, dtype=np.float32)
+        samples *= cdf_high - cdf_low
+        samples += cdf_low
+        ndtri(samples, out=samples)
+        samples *= stds
+        samples += means
+        # Guards float32 rounding at the bounds (and ndtri(0) = -inf when cdf_low underflows)
+        np.clip(samples, np.float32(SCORE_MIN), np.float32(SCORE_MAX), out=samples)
+        return samples
+    
+    def _simulate_truncated_normal(self, mean: float, std: float, iterations: int) -> Dict:
+        """
+        Sample a truncated normal and summarize it
+        Uses the fused Numba kernel when available and the rejection rate is
+        low, otherwise the NumPy inverse-CDF sampler
+        """
+        acceptance = ndtr((SCORE_MAX - mean) / std) - ndtr((SCORE_MIN - mean) / std)
+        if NUMBA_AVAILABLE and acceptance >= KERNEL_MIN_ACCEPTANCE:
+            seed = int(self.rng.integers(2**32))
+            with KERNEL_LOCK:
+                simulations, total, total_sq = simulate_truncated_normal(
+                    mean, std, SCORE_MIN, SCORE_MAX, iterations, seed
+                )
+            return _summarize(simulations, total, total_sq)
+        
+        return _summarize(self._sample_truncated_normal(mean, std, iterations))
+    
     def run_simulation(
         self,
         risk_category: str,
@@ -38,50 +173,42 @@ class MonteCarloSimulator:
             if use_cached_data:
                 historical_scores = self._get_historical_scores(risk_category)
             else:
-                historical_scores = []
+                historical_scores = np.empty(0)
             
             # If no historical data, use default parameters
-            if not historical_scores or len(historical_scores) < 2:
+            if len(historical_scores) < 2:
                 logger.warning(f"Insufficient historical data for {risk_category}, using defaults")
                 risk_mean = 50.0
                 risk_std = 15.0
             else:
                 # Calculate mean and standard deviation from historical data
-                scores_array = np.array(historical_scores)
-                risk_mean = float(np.mean(scores_array))
-                risk_std = float(np.std(scores_array))
+                risk_mean = float(historical_scores.mean())
+                risk_std = float(historical_scores.std())
                 
                 # Ensure minimum std to avoid zero variance
                 if risk_std < 1.0:
                     risk_std = 10.0
             
-            # Run Monte Carlo simulation using normal distribution
-            # This assumes risk scores follow a normal distribution
-            simulations = np.random.normal(risk_mean, risk_std, iterations)
-            
-            # Clip values to valid range [0, 100]
-            simulations = np.clip(simulations, 0, 100)
+            # Reuse a recent run on the same inputs; new scores change the hash,
+            # so results are invalidated as soon as the history moves
+            raw_hash = hashlib.blake2b(historical_scores.tobytes(), digest_size=16).hexdigest()
+            cached = self._get_recent_result(risk_category, iterations, raw_hash)
+            if cached is not None:
+                return cached
             
-            # Calculate statistics
-            sim_mean = float(np.mean(simulations))
-            sim_std = float(np.std(simulations))
-            percentiles = {
-                "5": float(np.percentile(simulations, 5)),
-                "50": float(np.percentile(simulations, 50)),
-                "95": float(np.percentile(simulations, 95))
-            }
+            # Run Monte Carlo simulation using a normal distribution
+            # truncated to the valid score range [0, 100]
+            stats = self._simulate_truncated_normal(risk_mean, risk_std, iterations)
             
             # Store result in database
             result = {
                 "risk_category": risk_category,
-                "mean": sim_mean,
-                "std": sim_std,
-                "percentiles": percentiles,
+                **stats,
                 "iterations": iterations,
                 "calculated_at": datetime.utcnow()
             }
             
-            self._store_result(result)
+            self._store_result(result, raw_hash)
             
             return result
             
@@ -97,24 +224,44 @@ class MonteCarloSimulator:
                 "calculated_at": datetime.utcnow()
             }
     
-    def _get_historical_scores(self, risk_category: str, limit: int = 30) -> list:
-        """Get historical risk scores from database"""
+    def _get_historical_scores(self, risk_category: str, limit: int = 30) -> np.ndarray:
+        """Get historical risk scores as a float array"""
+        try:
+            return get_recent_scores(risk_category, limit)
+        except Exception as e:
+            logger.error(f"Error fetching historical scores: {e}")
+            return np.empty(0)
+    
+    def _get_recent_result(self, risk_category: str, iterations: int, raw_hash: str) -> Optional[Dict]:
+        """Get a stored result for the same inputs calculated within RESULT_REUSE_MINUTES"""
         db = SessionLocal()
         try:
-            scores = db.query(RiskScore).filter(
-                RiskScore.risk_category == risk_category
+            mc_result = db.query(MonteCarloResult).filter(
+                MonteCarloResult.risk_category == risk_category,
+                MonteCarloResult.iterations == iterations,
+                MonteCarloResult.raw_hash == raw_hash,
+                MonteCarloResult.calculated_at > datetime.utcnow() - timedelta(minutes=RESULT_REUSE_MINUTES)
             ).order_by(
-                RiskScore.calculated_at.desc()
-            ).limit(limit).all()
+                MonteCarloResult.calculated_at.desc()
+            ).first()
             
-            return [score.score for score in scores]
+            if mc_result is None:
+                return None
+            return {
+                "risk_category": mc_result.risk_category,
+                "mean": mc_result.mean,
+                "std": mc_result.std,
+                "percentiles": mc_result.percentiles,
+                "iterations": mc_result.iterations,
+                "calculated_at": mc_result.calculated_at
+            }
         except Exception as e:
-            logger.error(f"Error fetching historical scores: {e}")
-            return []
+            logger.error(f"Error fetching stored Monte Carlo result: {e}")
+            return None
         finally:
             db.close()
     
-    def _store_result(self, result: Dict):
+    def _store_result(self, result: Dict, raw_hash: Optional[str] = None):
         """Store Monte Carlo result in database"""
         db = SessionLocal()
         try:
@@ -123,7 +270,8 @@ class MonteCarloSimulator:
                 mean=result["mean"],
                 std=result["std"],
                 percentiles=result["percentiles"],
-                iterations=result["iterations"]
+                iterations=result["iterations"],
+                raw_hash=raw_hash
             )
             db.add(mc_result)
             db.commit()
@@ -133,6 +281,24 @@ class MonteCarloSimulator:
         finally:
             db.close()
     
+    def run_all(self, stream_params: List[Tuple[float, float]], iterations: int = 5000) -> List[Dict]:
+        """
+        Simulate several independent (mean, std) streams in one batched draw
+        
+        Args:
+            stream_params: List of (mean, std) pairs, one per stream
+            iterations: Number of simulation iterations per stream
+        
+        Returns:
+            List of mean/std/percentile dictionaries in stream order
+        """
+        # One (iterations, streams) matrix reduced along axis 0 instead of a draw per stream
+        means = np.array([mean for mean, _ in stream_params], dtype=np.float64)
+        stds = np.array([std for _, std in stream_params], dtype=np.float64)
+        
+        simulations = self._sample_truncated_normal(means, stds, (iterations, len(stream_params)))
+        return _summarize_columns(simulations)
+    
     def run_multiple_scenarios(
         self,
         risk_category: str,
@@ -156,25 +322,8 @@ class MonteCarloSimulator:
                 "pessimistic": {"mean": 70, "std": 15}
             }
         
-        results = {}
-        for scenario_name, params in scenarios.items():
-            iterations = 5000
-            simulations = np.random.normal(
-                params["mean"],
-                params["std"],
-                iterations
-            )
-            simulations = np.clip(simulations, 0, 100)
-            
-            results[scenario_name] = {
-                "mean": float(np.mean(simulations)),
-                "std": float(np.std(simulations)),
-                "percentiles": {
-                    "5": float(np.percentile(simulations, 5)),
-                    "50": float(np.percentile(simulations, 50)),
-                    "95": float(np.percentile(simulations, 95))
-                }
-            }
+        params = [(p["mean"], p["std"]) for p in scenarios.values()]
+        results = dict(zip(scenarios.keys(), self.run_all(params, iterations=5000)))
         
         return {
             "risk_category": risk_category,
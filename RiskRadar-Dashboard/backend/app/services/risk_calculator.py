@@ -3,81 +3,229 @@ Risk calculation service
 Aggregates data from various sources to calculate risk scores
 """
 
+import asyncio
+import functools
+import inspect
 import numpy as np
-from datetime import datetime
-from typing import Dict, Optional
+from collections import defaultdict
+from datetime import datetime, timedelta
+from operator import methodcaller
+from statistics import fmean, pstdev
+from typing import Dict, List, Optional, Sequence, Tuple
+from cachetools import TTLCache
 from sqlalchemy.orm import Session
-from app.database import RiskScore, SessionLocal
+from app.database import RiskScore, session_scope
 from app.services.data_fetchers import (
     AlphaVantageFetcher, FREDFetcher, SECFetcher, 
-    NewsAPIFetcher, BLSFetcher
+    NewsAPIFetcher, BLSFetcher, create_http_client, CACHE_EXPIRY_HOURS
 )
+from app.services.score_history import commit_scores
 import os
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Risk categories in dashboard order
+RISK_CATEGORIES = ("market", "supply_chain", "regulatory", "hr")
+
+# Weight of each category in the overall risk, aligned with RISK_CATEGORIES
+RISK_WEIGHTS = np.array([0.3, 0.25, 0.25, 0.2])
+
+# Recent revenue filings used for the regulatory volatility measure
+REVENUE_WINDOW = 4
+
+# Value of an SEC filing fact, 0 when missing
+_filing_value = methodcaller("get", "val", 0)
+
+# Errors from malformed upstream values, skipped per signal
+PARSE_ERRORS = (KeyError, IndexError, TypeError, ValueError, AttributeError)
+
+# Age up to which the last stored score is served when a calculation fails
+STALE_SCORE_MAX_HOURS = 48
+
+# Calculated results kept in memory as long as the fetched source data
+RESULT_CACHE_SECONDS = CACHE_EXPIRY_HOURS * 3600
+
+
+def _clip_score(score: float) -> float:
+    """Clamp a score to 0-100 with plain comparisons, no min/max calls"""
+    return 0.0 if score < 0 else 100.0 if score > 100 else score
+
+
+def _parse_percent(value: str) -> float:
+    """Number in a percentage string such as "-1.2345%"; raises ValueError if malformed"""
+    return float(value.rstrip("%"))
+
+
+def _coefficient_of_variation(values: List[float]) -> float:
+    """Standard deviation over mean of values, 0 when the mean is not positive"""
+    # statistics beats NumPy's dispatch and allocation for a few filings
+    mean = fmean(values)
+    std = pstdev(values, mean)
+    return std / mean if mean > 0 else 0.0
+
+
+def _change_summary(changes: List[float]) -> Tuple[float, float]:
+    """Mean absolute and mean signed value of per-symbol percentage changes"""
+    return fmean(map(abs, changes)), fmean(changes)
+
+
+def _cached_risk(category: str):
+    """
+    Serve a calculate_*_risk method from the calculator's TTL cache
+    Results are keyed by category and the method's arguments (other than db).
+    Concurrent misses on one key wait on a per-key lock so only one of them
+    calculates; stale fallbacks from failed calculations are not cached.
+    Pass refresh=True to recalculate and replace the cached result, and a
+    new_scores list to collect freshly calculated results for storing.
+    """
+    def decorator(method):
+        signature = inspect.signature(method)
+        
+        @functools.wraps(method)
+        async def wrapper(
+            self, *args, db: Optional[Session] = None, refresh: bool = False,
+            new_scores: Optional[List[Dict]] = None, **kwargs
+        ):
+            bound = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            key = (category, *(
+                tuple(v) if isinstance(v, list) else v
+                for name, v in bound.arguments.items() if name not in ("self", "db")
+            ))
+            
+            cached = None if refresh else self._result_cache.get(key)
+            if cached is not None:
+                return cached
+            
+            async with self._result_locks[key]:
+                # Another caller may have filled the entry while we waited
+                cached = None if refresh else self._result_cache.get(key)
+                if cached is not None:
+                    return cached
+                
+                result = await method(self, *args, db=db, **kwargs)
+                if not result.get("stale"):
+                    self._result_cache[key] = result
+                    if new_scores is not None:
+                        new_scores.append(result)
+                return result
+        
+        return wrapper
+    return decorator
+
 
 class RiskCalculator:
     """Calculate risk scores from various data sources"""
     
     def __init__(self):
-        self.alpha_vantage = AlphaVantageFetcher(os.getenv("ALPHA_VANTAGE_API_KEY"))
-        self.fred = FREDFetcher(os.getenv("FRED_API_KEY"))
-        self.sec = SECFetcher()
-        self.news = NewsAPIFetcher(os.getenv("NEWS_API_KEY"))
-        self.bls = BLSFetcher()
+        # One connection pool shared by every fetcher
+        self.client = create_http_client()
+        self.alpha_vantage = AlphaVantageFetcher(os.getenv("ALPHA_VANTAGE_API_KEY"), client=self.client)
+        self.fred = FREDFetcher(os.getenv("FRED_API_KEY"), client=self.client)
+        self.sec = SECFetcher(client=self.client)
+        self.news = NewsAPIFetcher(os.getenv("NEWS_API_KEY"), client=self.client)
+        self.bls = BLSFetcher(client=self.client)
+        
+        # Calculated results by (category, *arguments), see _cached_risk
+        self._result_cache = TTLCache(maxsize=128, ttl=RESULT_CACHE_SECONDS)
+        self._result_locks = defaultdict(asyncio.Lock)
+        
+        # Category name -> calculator method, for dispatch by name
+        self._calculators = {
+            "market": self.calculate_market_risk,
+            "supply_chain": self.calculate_supply_chain_risk,
+            "regulatory": self.calculate_regulatory_risk,
+            "hr": self.calculate_hr_risk
+        }
+    
+    async def aclose(self):
+        """Close the shared HTTP client and its pooled connections"""
+        await self.client.aclose()
+    
+    async def calculate_category_risk(
+        self, category: str, db: Optional[Session] = None, refresh: bool = False
+    ) -> Dict:
+        """
+        Calculate the risk for one category by name (see RISK_CATEGORIES)
+        Cached results are returned unless refresh is set; a freshly
+        calculated score is stored
+        """
+        new_scores = []
+        result = await self._calculators[category](db=db, refresh=refresh, new_scores=new_scores)
+        if new_scores:
+            await self._store_risk_scores(new_scores, db=db)
+        return result
     
-    def calculate_market_risk(self, symbol: str = "SPY") -> Dict:
+    @_cached_risk("market")
+    async def calculate_market_risk(
+        self, symbols: Sequence[str] = ("SPY",), db: Optional[Session] = None
+    ) -> Dict:
         """
         Calculate market risk from stock volatility and economic indicators
+        Volatility is the mean absolute daily change across symbols
         Returns normalized score 0-100
         """
         try:
-            # Get stock data
-            stock_data = self.alpha_vantage.get_stock_quote(symbol)
+            # Get quotes for every symbol, each cached on its own
+            quotes = await self.alpha_vantage.get_batch_quotes(symbols)
             
             # Get economic indicators (GDP growth, unemployment)
-            gdp_data = self.fred.get_economic_indicator("GDPC1", limit=20)  # Real GDP
-            unrate_data = self.fred.get_economic_indicator("UNRATE", limit=20)  # Unemployment
+            gdp_data = await self.fred.get_economic_indicator("GDPC1", limit=20, db=db)  # Real GDP
+            unrate_data = await self.fred.get_economic_indicator("UNRATE", limit=20, db=db)  # Unemployment
             
             score = 50.0  # Base score
             raw_data = {}
             
-            # Calculate volatility from stock price change
-            if stock_data and "Global Quote" in stock_data:
-                quote = stock_data["Global Quote"]
-                change_percent = float(quote.get("10. change percent", "0%").replace("%", ""))
-                # Higher volatility = higher risk
-                volatility_score = min(100, 50 + abs(change_percent) * 2)
-                score = (score + volatility_score) / 2
-                raw_data["stock_change"] = change_percent
+            # Each signal is parsed on its own so a malformed one is skipped
+            # while the others still contribute
+            # Calculate volatility from stock price changes
+            if quotes:
+                try:
+                    changes = {
+                        symbol: _parse_percent(quote.get("10. change percent", "0%"))
+                        for symbol, quote in quotes.items()
+                    }
+                    mean_abs_change, mean_change = _change_summary(list(changes.values()))
+                    # Higher volatility = higher risk
+                    volatility_score = 50 + min(25, mean_abs_change) * 2
+                    score = (score + volatility_score) / 2
+                    raw_data["stock_change"] = mean_change
+                    raw_data["stock_changes"] = changes
+                except PARSE_ERRORS as e:
+                    logger.warning(f"Skipping stock quotes in market risk: {e}")
             
             # Factor in economic indicators
             if gdp_data and "observations" in gdp_data:
-                observations = gdp_data["observations"][:2]
-                if len(observations) >= 2:
-                    recent = float(observations[0].get("value", 0))
-                    previous = float(observations[1].get("value", 0))
-                    if previous > 0:
-                        gdp_growth = ((recent - previous) / previous) * 100
-                        # Negative growth increases risk
-                        if gdp_growth < 0:
-                            score += abs(gdp_growth) * 5
-                        raw_data["gdp_growth"] = gdp_growth
+                try:
+                    observations = gdp_data["observations"][:2]
+                    if len(observations) >= 2:
+                        recent = float(observations[0].get("value", 0))
+                        previous = float(observations[1].get("value", 0))
+                        if previous > 0:
+                            gdp_growth = ((recent - previous) / previous) * 100
+                            # Negative growth increases risk
+                            if gdp_growth < 0:
+                                score += abs(gdp_growth) * 5
+                            raw_data["gdp_growth"] = gdp_growth
+                except PARSE_ERRORS as e:
+                    logger.warning(f"Skipping GDP data in market risk: {e}")
             
             if unrate_data and "observations" in unrate_data:
-                latest = unrate_data["observations"][0]
-                unemployment = float(latest.get("value", 0))
-                # Higher unemployment = higher risk
-                score += unemployment * 2
-                raw_data["unemployment"] = unemployment
+                try:
+                    latest = unrate_data["observations"][0]
+                    unemployment = float(latest.get("value", 0))
+                    # Higher unemployment = higher risk
+                    score += unemployment * 2
+                    raw_data["unemployment"] = unemployment
+                except PARSE_ERRORS as e:
+                    logger.warning(f"Skipping unemployment data in market risk: {e}")
             
-            # Normalize to 0-100
-            final_score = max(0, min(100, score))
+            if not raw_data:
+                return await self._default_risk("market")
             
-            # Store in database
-            self._store_risk_score("market", final_score, raw_data)
+            # Normalize to 0-100
+            final_score = _clip_score(score)
             
             return {
                 "category": "market",
@@ -87,9 +235,10 @@ class RiskCalculator:
             }
         except Exception as e:
             logger.error(f"Error calculating market risk: {e}")
-            return self._default_risk("market")
+            return await self._default_risk("market")
     
-    def calculate_supply_chain_risk(self) -> Dict:
+    @_cached_risk("supply_chain")
+    async def calculate_supply_chain_risk(self, db: Optional[Session] = None) -> Dict:
         """
         Calculate supply chain risk from news sentiment and trade data
         """
@@ -98,7 +247,7 @@ class RiskCalculator:
             raw_data = {}
             
             # Get news about supply chain disruptions
-            news_data = self.news.get_risk_news("supply chain disruption OR logistics OR shipping delay", page_size=20)
+            news_data = await self.news.get_risk_news("supply chain disruption OR logistics OR shipping delay", page_size=20, db=db)
             
             if news_data and "articles" in news_data:
                 article_count = len(news_data["articles"])
@@ -115,9 +264,10 @@ class RiskCalculator:
                     for article in news_data["articles"][:5]
                 ]
             
-            final_score = max(0, min(100, score))
-            self._store_risk_score("supply_chain", final_score, raw_data)
+            if not raw_data:
+                return await self._default_risk("supply_chain")
             
+            final_score = _clip_score(score)
             return {
                 "category": "supply_chain",
                 "score": round(final_score, 2),
@@ -126,9 +276,10 @@ class RiskCalculator:
             }
         except Exception as e:
             logger.error(f"Error calculating supply chain risk: {e}")
-            return self._default_risk("supply_chain")
+            return await self._default_risk("supply_chain")
     
-    def calculate_regulatory_risk(self, cik: str = "0000789019") -> Dict:  # Default: Apple Inc
+    @_cached_risk("regulatory")
+    async def calculate_regulatory_risk(self, cik: str = "0000789019", db: Optional[Session] = None) -> Dict:  # Default: Apple Inc
         """
         Calculate regulatory risk from SEC filings frequency and changes
         """
@@ -137,7 +288,7 @@ class RiskCalculator:
             raw_data = {}
             
             # Get revenue data to check for volatility (proxy for regulatory impact)
-            sec_data = self.sec.get_company_filings(cik, concept="Revenues")
+            sec_data = await self.sec.get_company_filings(cik, concept="Revenues", db=db)
             
             if sec_data and "units" in sec_data:
                 # Analyze filing frequency and revenue trends
@@ -145,18 +296,19 @@ class RiskCalculator:
                 if "USD" in units:
                     revenues = units["USD"]
                     if len(revenues) >= 2:
-                        # Calculate revenue volatility
-                        values = [float(r.get("val", 0)) for r in revenues[-4:]]
-                        if len(values) >= 2:
-                            volatility = np.std(values) / np.mean(values) if np.mean(values) > 0 else 0
-                            # Higher volatility might indicate regulatory uncertainty
-                            score += volatility * 20
-                            raw_data["revenue_volatility"] = volatility
-                            raw_data["filing_count"] = len(revenues)
+                        # Calculate revenue volatility over the last four filings
+                        # map/methodcaller run the extraction and conversion in C
+                        values = list(map(float, map(_filing_value, revenues[-REVENUE_WINDOW:])))
+                        volatility = _coefficient_of_variation(values)
+                        # Higher volatility might indicate regulatory uncertainty
+                        score += volatility * 20
+                        raw_data["revenue_volatility"] = volatility
+                        raw_data["filing_count"] = len(revenues)
             
-            final_score = max(0, min(100, score))
-            self._store_risk_score("regulatory", final_score, raw_data)
+            if not raw_data:
+                return await self._default_risk("regulatory")
             
+            final_score = _clip_score(score)
             return {
                 "category": "regulatory",
                 "score": round(final_score, 2),
@@ -165,9 +317,10 @@ class RiskCalculator:
             }
         except Exception as e:
             logger.error(f"Error calculating regulatory risk: {e}")
-            return self._default_risk("regulatory")
+            return await self._default_risk("regulatory")
     
-    def calculate_hr_risk(self) -> Dict:
+    @_cached_risk("hr")
+    async def calculate_hr_risk(self, db: Optional[Session] = None) -> Dict:
         """
         Calculate HR risk from labor market data
         """
@@ -176,7 +329,7 @@ class RiskCalculator:
             raw_data = {}
             
             # Get unemployment data from BLS
-            bls_data = self.bls.get_employment_data("LNS14000000")  # Unemployment rate
+            bls_data = await self.bls.get_employment_data("LNS14000000", db=db)  # Unemployment rate
             
             if bls_data and "Results" in bls_data:
                 series = bls_data["Results"].get("series", [])
@@ -191,9 +344,10 @@ class RiskCalculator:
                         raw_data["unemployment_rate"] = recent
                         raw_data["unemployment_change"] = recent - previous
             
-            final_score = max(0, min(100, score))
-            self._store_risk_score("hr", final_score, raw_data)
+            if not raw_data:
+                return await self._default_risk("hr")
             
+            final_score = _clip_score(score)
             return {
                 "category": "hr",
                 "score": round(final_score, 2),
@@ -202,55 +356,109 @@ class RiskCalculator:
             }
         except Exception as e:
             logger.error(f"Error calculating HR risk: {e}")
-            return self._default_risk("hr")
+            return await self._default_risk("hr")
+    
+    async def calculate_risks(self, categories: Sequence[str], refresh: bool = False) -> List[Dict]:
+        """
+        Calculate several risk categories by name, concurrently
+        Each category opens its own database sessions for reads; their scores
+        are then stored together with one session and a single commit, all
+        in worker threads so the event loop is never blocked on the database
+        """
+        new_scores = []
+        results = await asyncio.gather(*(
+            self._calculators[category](refresh=refresh, new_scores=new_scores)
+            for category in categories
+        ))
+        
+        # Categories served from the result cache or a stale fallback add nothing
+        if new_scores:
+            await self._store_risk_scores(new_scores)
+        return results
     
-    def calculate_all_risks(self) -> Dict:
+    async def calculate_all_risks(self) -> Dict:
         """Calculate all risk categories and overall risk"""
-        market = self.calculate_market_risk()
-        supply_chain = self.calculate_supply_chain_risk()
-        regulatory = self.calculate_regulatory_risk()
-        hr = self.calculate_hr_risk()
+        results = await self.calculate_risks(RISK_CATEGORIES)
         
-        # Overall risk is weighted average
-        overall = (
-            market["score"] * 0.3 +
-            supply_chain["score"] * 0.25 +
-            regulatory["score"] * 0.25 +
-            hr["score"] * 0.2
-        )
+        # Overall risk is the weighted average; the weighted variance and the
+        # concentration (Herfindahl index of each category's share of the
+        # overall risk, 1/N when even, 1 when one category carries it all)
+        # show how unevenly the risk is spread
+        scores = np.array([result["score"] for result in results])
+        overall = float(scores @ RISK_WEIGHTS / RISK_WEIGHTS.sum())
+        variance = float(RISK_WEIGHTS @ (scores - overall) ** 2 / RISK_WEIGHTS.sum())
+        if overall > 0:
+            shares = RISK_WEIGHTS * scores / (overall * RISK_WEIGHTS.sum())
+            concentration = float(shares @ shares)
+        else:
+            concentration = 0.0
         
         return {
-            "market_risk": market,
-            "supply_chain_risk": supply_chain,
-            "regulatory_risk": regulatory,
-            "hr_risk": hr,
+            **{f"{category}_risk": result for category, result in zip(RISK_CATEGORIES, results)},
             "overall_risk": round(overall, 2),
+            "risk_variance": round(variance, 2),
+            "risk_concentration": round(concentration, 4),
             "last_updated": datetime.utcnow()
         }
     
-    def _store_risk_score(self, category: str, score: float, raw_data: Dict):
-        """Store risk score in database"""
-        db = SessionLocal()
+    async def _store_risk_scores(self, results: List[Dict], db: Optional[Session] = None):
+        """Store calculated risk results in database, without blocking the event loop"""
+        await asyncio.to_thread(self._store_risk_scores_sync, results, db)
+    
+    def _store_risk_scores_sync(self, results: List[Dict], db: Optional[Session] = None):
+        """Store calculated risk results in database with one commit"""
+        with session_scope(db) as db:
+            try:
+                # Scores written together share one timestamp
+                now = datetime.utcnow()
+                db.add_all([
+                    RiskScore(
+                        risk_category=result["category"],
+                        score=result["score"],
+                        raw_data=result["raw_data"],
+                        calculated_at=now
+                    )
+                    for result in results
+                ])
+                commit_scores(db, [(result["category"], result["score"]) for result in results])
+            except Exception as e:
+                logger.error(f"Error storing risk scores: {e}")
+                db.rollback()
+    
+    async def _default_risk(self, category: str) -> Dict:
+        """Fallback risk when calculation fails or no source data is available"""
+        return await asyncio.to_thread(self._default_risk_sync, category)
+    
+    def _default_risk_sync(self, category: str) -> Dict:
+        """
+        Fallback risk when calculation fails or no source data is available
+        Serves the last stored score if it is recent enough, marked stale,
+        otherwise the neutral default
+        """
         try:
-            risk_score = RiskScore(
-                risk_category=category,
-                score=score,
-                raw_data=raw_data
-            )
-            db.add(risk_score)
-            db.commit()
+            with session_scope() as db:
+                last = db.query(RiskScore).filter(
+                    RiskScore.risk_category == category,
+                    RiskScore.calculated_at > datetime.utcnow() - timedelta(hours=STALE_SCORE_MAX_HOURS)
+                ).order_by(
+                    RiskScore.calculated_at.desc()
+                ).first()
+                
+                if last is not None:
+                    return {
+                        "category": category,
+                        "score": round(last.score, 2),
+                        "raw_data": last.raw_data,
+                        "calculated_at": last.calculated_at,
+                        "stale": True
+                    }
         except Exception as e:
-            logger.error(f"Error storing risk score: {e}")
-            db.rollback()
-        finally:
-            db.close()
-    
-    def _default_risk(self, category: str) -> Dict:
-        """Return default risk score when calculation fails"""
+            logger.error(f"Error fetching last stored {category} risk: {e}")
+        
         return {
             "category": category,
             "score": 50.0,
             "raw_data": {"error": "Calculation failed, using default"},
-            "calculated_at": datetime.utcnow()
+            "calculated_at": datetime.utcnow(),
+            "stale": True
         }
-
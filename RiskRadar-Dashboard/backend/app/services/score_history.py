@@ -0,0 +1,73 @@
+"""
+In-process history of recent risk scores
+Keeps the last scores per category as plain floats so Monte Carlo runs
+do not need a database round-trip for their historical inputs
+"""
+
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Tuple
+import numpy as np
+from sqlalchemy.orm import Session
+from app.database import RiskScore, session_scope
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Number of recent scores kept per category
+HISTORY_SIZE = 30
+
+_history: Dict[str, Deque[float]] = {}
+_lock = threading.Lock()
+
+
+def _load_scores(risk_category: str, limit: int) -> np.ndarray:
+    """Load the most recent scores for a category from the database, oldest first"""
+    with session_scope() as db:
+        # Select only the score column, skipping ORM hydration and raw_data decoding
+        rows = db.query(RiskScore.score).filter(
+            RiskScore.risk_category == risk_category
+        ).order_by(
+            RiskScore.calculated_at.desc()
+        ).limit(limit).all()
+        
+        scores = np.fromiter((row[0] for row in rows), dtype=np.float64, count=len(rows))
+        return scores[::-1]
+
+
+def get_recent_scores(risk_category: str, limit: int = HISTORY_SIZE) -> np.ndarray:
+    """
+    Get up to `limit` recent scores for a category, oldest first
+    Served from memory once the category has been loaded; requests for
+    more than HISTORY_SIZE scores always go to the database
+    """
+    if limit > HISTORY_SIZE:
+        return _load_scores(risk_category, limit)
+    
+    with _lock:
+        history = _history.get(risk_category)
+        if history is None:
+            # Loaded under the lock so no concurrently recorded score is missed
+            history = deque(_load_scores(risk_category, HISTORY_SIZE).tolist(), maxlen=HISTORY_SIZE)
+            _history[risk_category] = history
+        scores = np.fromiter(history, dtype=np.float64, count=len(history))
+    
+    return scores[-limit:] if limit > 0 else scores[:0]
+
+
+def commit_scores(db: Session, scores: List[Tuple[str, float]]):
+    """
+    Commit the session holding new (category, score) rows and append the
+    scores to the loaded in-memory histories
+    Both happen under the history lock, so a concurrent first load either
+    runs before the commit (and misses the rows the append then adds) or
+    after it (and reads them, the append having skipped that category),
+    never counting a score twice
+    """
+    with _lock:
+        db.commit()
+        for risk_category, score in scores:
+            history = _history.get(risk_category)
+            # Categories not loaded yet pick the score up from the database on first read
+            if history is not None:
+                history.append(score)